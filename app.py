@@ -1,7 +1,17 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
 from datetime import datetime, timedelta
-import requests
+import asyncio
+from io import BytesIO
+import hashlib
+import json
+import os
+import re
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import closing
+import httpx
 from bs4 import BeautifulSoup
 import time
 from openai import OpenAI
@@ -30,68 +40,371 @@ if "openai_client" not in st.session_state:
         st.warning("Please enter your OpenAI API key to proceed.")
         st.stop()
 
-def search_naver_news(keyword, start_date, end_date):
-    """Search Naver News with date filtering"""
-    try:
-        base_url = (
-            f"https://search.naver.com/search.naver?"
-            f"where=news&query={keyword}&sort=1"
-            f"&ds={start_date.strftime('%Y.%m.%d')}"
-            f"&de={end_date.strftime('%Y.%m.%d')}"
-        )
-        
-        headers = {'User-Agent': 'Mozilla/5.0'}
-        response = requests.get(base_url, headers=headers)
-        soup = BeautifulSoup(response.text, 'html.parser')
+class NaverSearchError(Exception):
+    """Raised when some keyword searches failed; carries the partial results"""
+    def __init__(self, articles, errors):
+        super().__init__("; ".join(errors))
+        self.articles = articles
+        self.errors = errors
+
+def _parse(html, keyword):
+    """Extract articles from a Naver search results page"""
+    soup = BeautifulSoup(html, 'lxml')
+    
+    articles = []
+    for item in soup.select('.news_area'):
+        title = item.select_one('.news_tit').text
+        media = item.select_one('.info_group a').text
         
-        articles = []
-        for item in soup.select('.news_area'):
-            title = item.select_one('.news_tit').text
-            media = item.select_one('.info_group a').text
+        try:
+            journalist = item.select_one('.info_group span.journalist').text
+        except:
+            journalist = "N/A"
             
-            try:
-                journalist = item.select_one('.info_group span.journalist').text
-            except:
-                journalist = "N/A"
-                
-            articles.append({
-                'title': title,
-                'media': media,
-                'journalist': journalist,
-                'keyword': keyword
-            })
-        return articles
-    except Exception as e:
-        st.error(f"Error searching Naver News: {str(e)}")
-        return []
-
-def get_summary_and_category(title):
-    """Generate summary and category using GPT"""
-    try:
-        prompt = f"""Analyze this news article title and provide:
-        1. A brief synopsis (2-3 sentences)
-        2. A category from these options: CIP, Govt policy, Local govt policy, Stakeholders, RE Industry, Impact on
-        
-        Title: {title}
-        
-        Format response as:
-        Category: [category]
-        Synopsis: [synopsis]
-        """
-        
-        response = st.session_state.openai_client.chat.completions.create(
-            model="gpt-3.5-turbo",
-            messages=[{"role": "user", "content": prompt}]
+        articles.append({
+            'title': title,
+            'media': media,
+            'journalist': journalist,
+            'keyword': keyword
+        })
+    return articles
+
+HEADERS = {'User-Agent': 'Mozilla/5.0'}
+POOL_SIZE = 16
+REQUEST_TIMEOUT = 10
+MAX_RETRIES = 3
+BACKOFF_FACTOR = 0.3
+
+async def _fetch(session, url):
+    """GET a page, retrying transient failures with exponential backoff"""
+    for attempt in range(MAX_RETRIES + 1):
+        try:
+            response = await session.get(url)
+            response.raise_for_status()
+            return response.text
+        except httpx.HTTPError as e:
+            client_fault = (
+                isinstance(e, httpx.HTTPStatusError)
+                and e.response.status_code < 500
+                and e.response.status_code != 429
+            )
+            if client_fault or attempt == MAX_RETRIES:
+                raise
+            await asyncio.sleep(BACKOFF_FACTOR * 2 ** attempt)
+
+async def search_naver_news(session, keyword, start_date, end_date):
+    """Search Naver News with date filtering"""
+    base_url = (
+        f"https://search.naver.com/search.naver?"
+        f"where=news&query={keyword}&sort=1"
+        f"&ds={start_date.strftime('%Y.%m.%d')}"
+        f"&de={end_date.strftime('%Y.%m.%d')}"
+    )
+    
+    html = await _fetch(session, base_url)
+    return await asyncio.to_thread(_parse, html, keyword)
+
+async def _gather_all(keywords, start_date, end_date):
+    """Run all keyword searches concurrently, multiplexed over HTTP/2"""
+    async with httpx.AsyncClient(
+        http2=True,
+        follow_redirects=True,
+        headers=HEADERS,
+        timeout=REQUEST_TIMEOUT,
+        limits=httpx.Limits(max_connections=POOL_SIZE)
+    ) as session:
+        return await asyncio.gather(*(
+            search_naver_news(session, keyword, start_date, end_date)
+            for keyword in keywords
+        ), return_exceptions=True)
+
+@st.cache_data(ttl=3600, show_spinner=False)
+def collect_articles(keywords, start_date, end_date):
+    """Fetch articles for all keywords, memoized per (keywords, date range).
+    
+    Failures are raised rather than returned so they are never cached.
+    """
+    results = asyncio.run(_gather_all(keywords, start_date, end_date))
+    articles, errors = [], []
+    for keyword, result in zip(keywords, results):
+        if isinstance(result, Exception):
+            errors.append(f"{keyword}: {str(result)}")
+        else:
+            articles.extend(result)
+    if errors:
+        raise NaverSearchError(articles, errors)
+    return articles
+
+MODEL = "gpt-4o-mini"
+MAX_TOKENS_PER_TITLE = 250
+BATCH_SIZE = 20
+MAX_WORKERS = 8
+MAX_UI_UPDATES = 20
+CACHE_PATH = os.path.expanduser("~/.news_monitor_cache.sqlite")
+ERROR_RESULT = ("N/A", "Error generating synopsis")
+EMBEDDING_MODEL = "text-embedding-3-small"
+SIMILARITY_THRESHOLD = 0.92
+
+# Titles matching these are categorized without calling GPT
+RULES = [
+    (re.compile(r"(?<![A-Za-z])CIP(?![A-Za-z])"), "CIP"),
+    (re.compile(r"한전|전기위원회"), "Govt policy"),
+    (re.compile(r"해상풍력"), "RE Industry"),
+]
+RULE_SYNOPSIS_LENGTH = 80
+
+def classify_by_rules(titles):
+    """Return {title: (category, synopsis)} for titles a keyword rule covers"""
+    classified = {}
+    for title in titles:
+        for pattern, category in RULES:
+            if pattern.search(title):
+                classified[title] = (category, title[:RULE_SYNOPSIS_LENGTH])
+                break
+    return classified
+
+def _cache_key(title):
+    return hashlib.sha256(f"{MODEL}|{title}".encode()).hexdigest()
+
+def _open_cache():
+    conn = sqlite3.connect(CACHE_PATH)
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS analyses "
+        "(key TEXT PRIMARY KEY, category TEXT, synopsis TEXT)"
+    )
+    return conn
+
+def load_cached_analyses(titles):
+    """Return {title: (category, synopsis)} for titles analyzed in earlier runs"""
+    with closing(_open_cache()) as conn:
+        cached = {}
+        for title in titles:
+            row = conn.execute(
+                "SELECT category, synopsis FROM analyses WHERE key = ?",
+                (_cache_key(title),)
+            ).fetchone()
+            if row:
+                cached[title] = row
+        return cached
+
+def save_analyses(analyses):
+    """Persist {title: (category, synopsis)} so later runs skip GPT for them"""
+    with closing(_open_cache()) as conn, conn:
+        conn.executemany(
+            "INSERT OR REPLACE INTO analyses VALUES (?, ?, ?)",
+            [(_cache_key(t), c, s) for t, (c, s) in analyses.items()]
         )
-        
-        result = response.choices[0].message.content
-        category = result.split('Category:')[1].split('\n')[0].strip()
-        synopsis = result.split('Synopsis:')[1].strip()
-        
-        return category, synopsis
-    except Exception as e:
-        st.error(f"Error getting summary: {str(e)}")
-        return "N/A", "Error generating synopsis"
+
+def group_near_duplicates(client, titles):
+    """Map each title to a representative of its near-duplicate cluster.
+    
+    Titles are embedded in one call and greedily clustered on cosine
+    similarity, so syndicated copies of a story are only analyzed once.
+    """
+    if len(titles) < 2:
+        return {t: t for t in titles}
+    
+    response = client.embeddings.create(model=EMBEDDING_MODEL, input=titles)
+    embs = np.array(
+        [d.embedding for d in sorted(response.data, key=lambda d: d.index)],
+        dtype=float
+    )
+    embs /= np.linalg.norm(embs, axis=1, keepdims=True)
+    sims = embs @ embs.T
+    
+    representative = {}
+    assigned = np.zeros(len(titles), dtype=bool)
+    for i, title in enumerate(titles):
+        if assigned[i]:
+            continue
+        members = np.flatnonzero(~assigned & (sims[i] >= SIMILARITY_THRESHOLD))
+        assigned[members] = True
+        for j in members:
+            representative[titles[j]] = title
+        representative[title] = title
+    return representative
+
+def propagate_to_duplicates(results, representative):
+    """Copy each representative's analysis to the rest of its cluster"""
+    return {
+        title: results[rep]
+        for title, rep in representative.items()
+        if rep in results
+    }
+
+def build_prompt(titles):
+    """Prompt asking for one JSON entry per numbered title"""
+    numbered = "\n".join(f"{n}. {title}" for n, title in enumerate(titles, 1))
+    return f"""For each numbered news title give a category from: CIP, Govt policy, Local govt policy, Stakeholders, RE Industry, Impact on
+    and a brief synopsis (2-3 sentences).
+    
+    {numbered}
+    
+    Return only JSON: {{"results": [{{"n": 1, "category": "...", "synopsis": "..."}}]}}
+    """
+
+def parse_results(content, titles):
+    """Map a JSON reply back to {title: (category, synopsis)}.
+    
+    Entries are matched on "n", so a missing or malformed entry only drops
+    that title instead of the whole batch.
+    """
+    parsed = {}
+    for entry in json.loads(content).get("results", []):
+        try:
+            n = int(entry["n"])
+            category, synopsis = str(entry["category"]), str(entry["synopsis"])
+        except (KeyError, TypeError, ValueError):
+            continue
+        if 1 <= n <= len(titles):
+            parsed[titles[n - 1]] = (category, synopsis)
+    return parsed
+
+def completion_params(titles):
+    """Chat completion arguments for one batch of titles"""
+    return {
+        "model": MODEL,
+        "temperature": 0,
+        "max_tokens": MAX_TOKENS_PER_TITLE * len(titles),
+        "response_format": {"type": "json_object"},
+        "messages": [{"role": "user", "content": build_prompt(titles)}]
+    }
+
+def get_summaries_and_categories(client, titles):
+    """Generate summaries and categories for a batch of titles in one GPT call.
+    
+    Runs on worker threads, so it must not touch st.* - errors propagate to
+    the caller instead of being reported here.
+    """
+    response = client.chat.completions.create(**completion_params(titles))
+    choice = response.choices[0]
+    if choice.finish_reason == "length":
+        # Truncated mid-JSON; retry each half rather than lose the whole batch.
+        # A single title that still truncates only drops itself.
+        if len(titles) == 1:
+            return {}
+        half = len(titles) // 2
+        results, errors = {}, []
+        for part in (titles[:half], titles[half:]):
+            try:
+                results.update(get_summaries_and_categories(client, part))
+            except Exception as e:
+                errors.append(e)
+        if len(errors) == 2:
+            raise errors[0]
+        return results
+    return parse_results(choice.message.content, titles)
+
+def submit_batch_job(client, titles):
+    """Queue titles on the OpenAI Batch API; return (batch id, title chunks).
+    
+    Each chunk's index is its request's custom_id, which retrieve_batch_job
+    uses to map replies back to titles.
+    """
+    chunks = [titles[i:i + BATCH_SIZE] for i in range(0, len(titles), BATCH_SIZE)]
+    lines = [
+        json.dumps({
+            "custom_id": str(i),
+            "method": "POST",
+            "url": "/v1/chat/completions",
+            "body": completion_params(chunk)
+        }, ensure_ascii=False)
+        for i, chunk in enumerate(chunks)
+    ]
+    batch_file = client.files.create(
+        file=("news_monitor_batch.jsonl", "\n".join(lines).encode("utf-8")),
+        purpose="batch"
+    )
+    batch = client.batches.create(
+        input_file_id=batch_file.id,
+        endpoint="/v1/chat/completions",
+        completion_window="24h"
+    )
+    return batch.id, chunks
+
+def retrieve_batch_job(client, batch_id, chunks):
+    """Return (status, {title: (category, synopsis)}, missing titles).
+    
+    Missing titles are those the batch output did not cover, e.g. failed or
+    truncated requests, so the caller can analyze them directly.
+    """
+    batch = client.batches.retrieve(batch_id)
+    if batch.status != "completed":
+        return batch.status, {}, []
+    
+    analyses = {}
+    output = client.files.content(batch.output_file_id).text if batch.output_file_id else ""
+    for line in output.splitlines():
+        # A malformed record (e.g. a refusal with null content) only leaves
+        # its chunk's titles missing instead of failing the whole retrieval
+        try:
+            record = json.loads(line)
+            response = record.get("response") or {}
+            if response.get("status_code") != 200:
+                continue
+            choice = response["body"]["choices"][0]
+            if choice.get("finish_reason") == "length":
+                continue
+            analyses.update(
+                parse_results(choice["message"]["content"], chunks[int(record["custom_id"])])
+            )
+        except (ValueError, TypeError, AttributeError, KeyError, IndexError):
+            continue
+    
+    missing = [t for chunk in chunks for t in chunk if t not in analyses]
+    return batch.status, analyses, missing
+
+def build_report(all_articles, analyses):
+    """Results table for the collected articles"""
+    categories, medias, journalists, synopses = [], [], [], []
+    for article in all_articles:
+        category, synopsis = analyses.get(article['title'], ERROR_RESULT)
+        categories.append(category)
+        medias.append(article['media'])
+        journalists.append(article['journalist'])
+        synopses.append(synopsis)
+    
+    df = pd.DataFrame({
+        'Category': pd.Categorical(categories),
+        'Media': medias,
+        'Journalist': journalists,
+        'Synopsis': synopses
+    }, copy=False)
+    # Dedupe on a vectorized 64-bit hash rather than the long synopsis strings.
+    # Media is part of the key: near-duplicate titles share their cluster's
+    # synopsis, and each outlet carrying the story should keep its row.
+    row_hash = pd.util.hash_pandas_object(df[['Media', 'Synopsis']], index=False)
+    return df[~row_hash.duplicated()]
+
+@st.cache_data(show_spinner=False)
+def to_csv_bytes(df):
+    return df.to_csv(index=False).encode('utf-8-sig')
+
+@st.cache_data(show_spinner=False)
+def to_xlsx_bytes(df):
+    buffer = BytesIO()
+    with pd.ExcelWriter(buffer, engine='xlsxwriter') as writer:
+        df.to_excel(writer, index=False)
+    return buffer.getvalue()
+
+def show_results(df):
+    """Render the results table and download buttons"""
+    st.subheader("📊 Results")
+    st.dataframe(df, use_container_width=True)
+    
+    # Download options
+    st.download_button(
+        "📥 Download CSV",
+        to_csv_bytes(df),
+        f"news_report_{datetime.now().strftime('%Y%m%d')}.csv",
+        "text/csv"
+    )
+    st.download_button(
+        "📥 Download Excel",
+        to_xlsx_bytes(df),
+        f"news_report_{datetime.now().strftime('%Y%m%d')}.xlsx",
+        "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+    )
 
 def main():
     st.title("📰 News Monitoring Dashboard")
@@ -127,59 +440,158 @@ def main():
     if custom_keyword:
         keywords.append(custom_keyword)
     
+    use_batch_api = st.checkbox("Use Batch API (24h, 50% cheaper)")
+    
     # Run button
     if st.button("🔍 Get News"):
         if not keywords:
             st.warning("Please select at least one keyword")
             return
         
+        st.session_state.pop("results", None)
         progress_bar = st.progress(0)
         status_text = st.empty()
         
         # Collect articles
-        all_articles = []
-        for i, keyword in enumerate(keywords):
-            status_text.text(f"Searching for: {keyword}")
-            articles = search_naver_news(keyword, start_date, end_date)
-            all_articles.extend(articles)
-            progress_bar.progress((i + 1) / len(keywords))
+        status_text.text(f"Searching for: {', '.join(keywords)}")
+        try:
+            all_articles = collect_articles(tuple(keywords), start_date, end_date)
+        except NaverSearchError as e:
+            st.error(f"Error searching Naver News: {str(e)}")
+            all_articles = e.articles
+        progress_bar.progress(1.0)
         
         # Process articles
-        processed_articles = []
-        total_articles = len(all_articles)
-        
-        for i, article in enumerate(all_articles):
-            status_text.text(f"Analyzing article {i+1} of {total_articles}")
-            category, synopsis = get_summary_and_category(article['title'])
-            
-            processed_articles.append({
-                'Category': category,
-                'Media': article['media'],
-                'Journalist': article['journalist'],
-                'Synopsis': synopsis
-            })
-            progress_bar.progress((i + 1) / total_articles)
-        
-        # Create DataFrame
-        df = pd.DataFrame(processed_articles)
-        df = df.drop_duplicates(subset=['Synopsis'])
-        
-        # Clear progress
-        progress_bar.empty()
-        status_text.empty()
+        titles = list(dict.fromkeys(a['title'] for a in all_articles))
+        analyses = classify_by_rules(titles)
+        try:
+            analyses.update(load_cached_analyses([t for t in titles if t not in analyses]))
+        except sqlite3.Error as e:
+            st.warning(f"Skipping analysis cache: {str(e)}")
+        pending = [t for t in titles if t not in analyses]
+        client = st.session_state.openai_client
         
-        # Display results
-        st.subheader("📊 Results")
-        st.dataframe(df, use_container_width=True)
+        try:
+            representative = group_near_duplicates(client, pending)
+        except Exception as e:
+            st.warning(f"Skipping near-duplicate grouping: {str(e)}")
+            representative = {t: t for t in pending}
+        pending = list(dict.fromkeys(representative.values()))
         
-        # Download options
-        csv = df.to_csv(index=False).encode('utf-8-sig')
-        st.download_button(
-            "📥 Download CSV",
-            csv,
-            f"news_report_{datetime.now().strftime('%Y%m%d')}.csv",
-            "text/csv"
-        )
+        if use_batch_api and pending:
+            try:
+                batch_id, chunks = submit_batch_job(client, pending)
+            except Exception as e:
+                st.error(f"Error submitting batch job: {str(e)}")
+                return
+            finally:
+                progress_bar.empty()
+                status_text.empty()
+            st.session_state.batch_job = {
+                'id': batch_id,
+                'chunks': chunks,
+                'articles': all_articles,
+                'analyses': analyses,
+                'representative': representative
+            }
+            st.info(
+                f"Submitted {len(pending)} titles as batch {batch_id}. "
+                "Use 'Retrieve Results' once it completes (up to 24h)."
+            )
+        else:
+            fresh = {}
+            done = len(titles) - len(pending)
+            table = st.empty()
+            
+            with ThreadPoolExecutor(max_workers=MAX_WORKERS) as ex:
+                futures = {
+                    ex.submit(get_summaries_and_categories, client, batch): batch
+                    for batch in (
+                        pending[start:start + BATCH_SIZE]
+                        for start in range(0, len(pending), BATCH_SIZE)
+                    )
+                }
+                step = max(1, len(futures) // MAX_UI_UPDATES)
+                for i, future in enumerate(as_completed(futures)):
+                    batch = futures[future]
+                    try:
+                        fresh.update(future.result())
+                    except Exception as e:
+                        st.error(f"Error getting summaries: {str(e)}")
+                    
+                    done += len(batch)
+                    if i % step and i != len(futures) - 1:
+                        continue
+                    status_text.text(f"Analyzed {done} of {len(titles)} titles")
+                    progress_bar.progress(done / len(titles))
+                    
+                    # Show rows as soon as their batch lands
+                    ready = {**analyses, **propagate_to_duplicates(fresh, representative)}
+                    ready_articles = [a for a in all_articles if a['title'] in ready]
+                    if ready_articles:
+                        table.dataframe(
+                            build_report(ready_articles, ready),
+                            use_container_width=True
+                        )
+            
+            table.empty()
+            fresh = propagate_to_duplicates(fresh, representative)
+            try:
+                save_analyses(fresh)
+            except sqlite3.Error as e:
+                st.warning(f"Could not save analysis cache: {str(e)}")
+            analyses.update(fresh)
+            st.session_state.results = build_report(all_articles, analyses)
+            
+            # Clear progress
+            progress_bar.empty()
+            status_text.empty()
+    
+    # Pending Batch API job
+    if "batch_job" in st.session_state:
+        job = st.session_state.batch_job
+        st.caption(f"Batch job {job['id']} pending")
+        if st.button("📬 Retrieve Results"):
+            try:
+                status, fresh, missing = retrieve_batch_job(
+                    st.session_state.openai_client, job['id'], job['chunks']
+                )
+            except Exception as e:
+                st.error(f"Error retrieving batch job: {str(e)}")
+                return
+            
+            if status in ("failed", "expired", "cancelled"):
+                st.error(f"Batch job {job['id']} {status}")
+                del st.session_state.batch_job
+            elif status != "completed":
+                st.info(f"Batch job {job['id']} is still {status}")
+            else:
+                if missing:
+                    st.warning(
+                        f"{len(missing)} titles missing from batch output; "
+                        "analyzing them directly"
+                    )
+                    for start in range(0, len(missing), BATCH_SIZE):
+                        try:
+                            fresh.update(get_summaries_and_categories(
+                                st.session_state.openai_client,
+                                missing[start:start + BATCH_SIZE]
+                            ))
+                        except Exception as e:
+                            st.error(f"Error getting summaries: {str(e)}")
+                fresh = propagate_to_duplicates(fresh, job['representative'])
+                try:
+                    save_analyses(fresh)
+                except sqlite3.Error as e:
+                    st.warning(f"Could not save analysis cache: {str(e)}")
+                del st.session_state.batch_job
+                st.session_state.results = build_report(
+                    job['articles'], {**job['analyses'], **fresh}
+                )
+    
+    # Results persist across reruns (e.g. clicking a download button)
+    if "results" in st.session_state:
+        show_results(st.session_state.results)
 
 if __name__ == "__main__":
     main()